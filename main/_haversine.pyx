@@ -0,0 +1,44 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled nearest-point search for dispatch.
+
+Built on first import by pyximport (see _haversine.pyxbld for compiler flags).
+The scan releases the GIL, but backend.py calls it under _fleet_lock, so
+dispatches still run one at a time; the gain is per-call cost only.
+"""
+from libc.math cimport sin, cos, asin, sqrt, M_PI
+
+cdef double DEG = M_PI / 180.0
+
+
+cdef Py_ssize_t _argmin(double lat, double lon,
+                        const double[::1] lats, const double[::1] lons) noexcept nogil:
+    cdef Py_ssize_t i, best = -1
+    cdef Py_ssize_t n = lats.shape[0]
+    cdef double lat1_r = lat * DEG
+    cdef double lon1_r = lon * DEG
+    cdef double coslat1 = cos(lat1_r)
+    cdef double lat2_r, sdlat, sdlon, a, c
+    cdef double min_c = 1e300
+
+    for i in range(n):
+        lat2_r = lats[i] * DEG
+        sdlat = sin((lat2_r - lat1_r) / 2)
+        sdlon = sin((lons[i] * DEG - lon1_r) / 2)
+        a = sdlat * sdlat + coslat1 * cos(lat2_r) * sdlon * sdlon
+        if a > 1.0:
+            a = 1.0
+        # Same formula as _dist_from in backend.py, minus the constant 2R
+        c = asin(sqrt(a))
+        if c < min_c:
+            min_c = c
+            best = i
+    return best
+
+
+def haversine_argmin(double lat, double lon, const double[::1] lats, const double[::1] lons):
+    """Index of the point in (lats, lons) closest to (lat, lon), or -1 if empty."""
+    cdef Py_ssize_t best
+    with nogil:
+        best = _argmin(lat, lon, lats, lons)
+    return best
@@ -1,47 +1,301 @@
-from flask import Flask, request, jsonify, send_from_directory, render_template, g
+from flask import Flask, request, jsonify, send_from_directory, render_template, g, Response
 from dotenv import load_dotenv
 from flask_cors import CORS
+from rtree import index
+import numpy as np
+import threading
+import queue
 import sqlite3
 import math
 import os
 
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    # Compiled on first import from _haversine.pyx
+    import pyximport
+    pyximport.install(language_level=3)
+    from _haversine import haversine_argmin
+except ImportError:
+    haversine_argmin = None
+
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 DB_FILE = "emergency.db"
 
+# Number of nearest units pulled from the R-tree before checking availability
+NEAREST_K = 8
+
+# Below this many candidates the scalar math path beats NumPy's call overhead
+VECTORIZE_MIN_CANDIDATES = 8
+
+# Open SQLite connections shared by request handlers
+DB_POOL_SIZE = 8
+
+# Size of each connection's compiled-statement cache (sqlite3 default: 128)
+DB_STATEMENT_CACHE = 256
+
+# ============ SQL ============
+
+# Fixed query text, so every execute() hits the connection's statement cache
+# instead of re-parsing
+SQL_ALL = "SELECT id, type, lat, lon, status FROM vehicles"
+# Row layout of SQL_ALL when fetched as plain tuples
+FLEET_DTYPE = [('id', 'O'), ('type', 'O'), ('lat', 'f8'), ('lon', 'f8'), ('status', 'O')]
+SQL_MARK_BUSY = "UPDATE vehicles SET status = 'busy' WHERE id = ?"
+SQL_RESET = "UPDATE vehicles SET status = 'available'"
+# The whole table as one JSON array, serialized by SQLite
+SQL_ALL_JSON = (
+    "SELECT json_group_array(json_object("
+    "'id', id, 'type', type, 'lat', lat, 'lon', lon, 'status', status, 'station_id', station_id"
+    ")) FROM vehicles"
+)
+
 app = Flask(__name__, template_folder='.')
 CORS(app)
 
 # ============ DATABASE CONNECTION ============
 
+def connect_db():
+    """Open an autocommit connection usable from any thread, tuned for this app."""
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None,
+                           cached_statements=DB_STATEMENT_CACHE)
+    conn.row_factory = sqlite3.Row  # Access columns by name
+    conn.execute("PRAGMA mmap_size = 268435456")
+    conn.execute("PRAGMA cache_size = -64000")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+# Connections are opened once and handed out per request context.
+# Handlers take theirs before _fleet_lock, so a thread holding the lock
+# never waits on the pool.
+_pool = queue.Queue(maxsize=DB_POOL_SIZE)
+for _ in range(DB_POOL_SIZE):
+    _pool.put(connect_db())
+
+
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DB_FILE)
-        db.row_factory = sqlite3.Row  # Access columns by name
+        db = g._database = _pool.get()
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        _pool.put(db)
 
 # ============ UTIL: DISTANCE ============
 
-def distance_km(lat1, lon1, lat2, lon2):
-    """Haversine distance in kilometers."""
+# The incident point is converted once per request and passed in as
+# (lat1_r, lon1_r, coslat1); only the candidate side varies per call.
+
+def _dist_from(lat1_r, lon1_r, coslat1, lat2, lon2):
+    """Haversine distance in kilometers from a pre-converted point."""
     R = 6371.0
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
+    lat2_r = math.radians(lat2)
+    dlat = lat2_r - lat1_r
+    dlon = math.radians(lon2) - lon1_r
     a = (math.sin(dlat / 2) ** 2 +
-         math.cos(math.radians(lat1)) *
-         math.cos(math.radians(lat2)) *
+         coslat1 *
+         math.cos(lat2_r) *
          math.sin(dlon / 2) ** 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    # Clamp: rounding can push a just past 1 near antipodes
+    c = 2.0 * math.asin(math.sqrt(min(a, 1.0)))
+    return R * c
+
+
+def _dists_from(lat1_r, lon1_r, coslat1, lats, lons):
+    """Vectorized Haversine distance from a pre-converted point to arrays of points."""
+    R = 6371.0
+    lats_r = np.radians(lats)
+    dlat = lats_r - lat1_r
+    dlon = np.radians(lons) - lon1_r
+    a = (np.sin(dlat / 2) ** 2 +
+         coslat1 *
+         np.cos(lats_r) *
+         np.sin(dlon / 2) ** 2)
+    c = 2.0 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
     return R * c
 
 
+if njit is not None:
+    @njit(cache=True, fastmath=True, boundscheck=False)
+    def _haversine_batch(lat0, lon0, lats, lons, out):
+        """JIT-compiled Haversine from (lat0, lon0) to each point, written into `out`."""
+        R = 6371.0
+        lat0_r = math.radians(lat0)
+        lon0_r = math.radians(lon0)
+        cos0 = math.cos(lat0_r)
+        for i in range(lats.shape[0]):
+            lat_r = math.radians(lats[i])
+            dlat = lat_r - lat0_r
+            dlon = math.radians(lons[i]) - lon0_r
+            a = (math.sin(dlat / 2) ** 2 +
+                 cos0 * math.cos(lat_r) * math.sin(dlon / 2) ** 2)
+            out[i] = 2.0 * R * math.asin(math.sqrt(min(a, 1.0)))
+
+    # Compile (or load from cache) at import rather than on the first dispatch
+    _haversine_batch(0.0, 0.0, np.zeros(2), np.zeros(2), np.empty(2))
+else:
+    _haversine_batch = None
+
+
+# ============ FLEET CACHE ============
+
+AVAILABLE, BUSY = 0, 1
+
+# Structure-of-arrays copy of the vehicles table, loaded from SQLite on first
+# use and reloaded on reset. Status changes hit VEH first; SQLite is updated
+# by the background writer.
+VEH = None
+# One 3-D R-tree per type code over unit-sphere (x, y, z) points; ids are row
+# indices into VEH. Straight-line (chord) distance between points on the
+# sphere grows monotonically with great-circle distance, so the tree's
+# nearest() order is the exact Haversine order.
+_trees = {}
+_fleet_lock = threading.Lock()
+# Serialized /api/vehicles payload (JSON text); cleared whenever VEH changes
+_vehicles_cache = None
+
+
+def unit_xyz(lat, lon):
+    """Unit-sphere coordinates of (lat, lon) in degrees; scalars or arrays."""
+    lat_r = np.radians(lat)
+    lon_r = np.radians(lon)
+    coslat = np.cos(lat_r)
+    return np.stack((coslat * np.cos(lon_r), coslat * np.sin(lon_r), np.sin(lat_r)), axis=-1)
+
+
+def load_fleet(db):
+    """Load the vehicles table into VEH and rebuild the per-type R-trees."""
+    global VEH, _trees, _vehicles_cache
+    # Plain tuples straight into one structured array, no sqlite3.Row per vehicle
+    cursor = db.cursor()
+    cursor.row_factory = None
+    rows = np.array(cursor.execute(SQL_ALL).fetchall(), dtype=FLEET_DTYPE)
+
+    types, type_codes = np.unique(rows['type'], return_inverse=True)
+
+    VEH = {
+        'id': rows['id'].tolist(),
+        'lat': np.ascontiguousarray(rows['lat']),
+        'lon': np.ascontiguousarray(rows['lon']),
+        'type': type_codes.astype('u1'),
+        'status': np.where(rows['status'] == 'available', AVAILABLE, BUSY).astype('u1'),
+        'xyz': unit_xyz(rows['lat'], rows['lon']),
+        'type_codes': {t: i for i, t in enumerate(types.tolist())},
+    }
+
+    props = index.Property()
+    props.dimension = 3
+
+    trees = {}
+    for i, (code, p) in enumerate(zip(VEH['type'].tolist(), VEH['xyz'].tolist())):
+        if code not in trees:
+            trees[code] = index.Index(properties=props)
+        trees[code].insert(i, p + p)
+    _trees = trees
+    _vehicles_cache = None
+
+
+def closest(idx, lat, lon):
+    """
+    Closest of the VEH rows `idx` to (lat, lon).
+    Returns (row index, distance km).
+
+    Called under _fleet_lock with at most about NEAREST_K rows. Uses the first
+    kernel available: Cython haversine_argmin, then numba, then plain Python
+    (NumPy only for unusually large candidate sets, e.g. R-tree ties).
+    """
+    lat1_r = math.radians(lat)
+    lon1_r = math.radians(lon)
+    coslat1 = math.cos(lat1_r)
+
+    if haversine_argmin is not None:
+        la, lo = VEH['lat'][idx], VEH['lon'][idx]
+        j = haversine_argmin(lat, lon, la, lo)
+        return int(idx[j]), _dist_from(lat1_r, lon1_r, coslat1, float(la[j]), float(lo[j]))
+
+    if _haversine_batch is not None:
+        d = np.empty(idx.size, dtype=np.float64)
+        _haversine_batch(lat, lon, VEH['lat'][idx], VEH['lon'][idx], d)
+        j = int(np.argmin(d))
+        return int(idx[j]), float(d[j])
+
+    # No compiled kernel: plain loop for a few candidates, NumPy otherwise
+    if idx.size < VECTORIZE_MIN_CANDIDATES:
+        best, min_dist = -1, float('inf')
+        for i, la, lo in zip(idx.tolist(), VEH['lat'][idx].tolist(), VEH['lon'][idx].tolist()):
+            d = _dist_from(lat1_r, lon1_r, coslat1, la, lo)
+            if d < min_dist:
+                best, min_dist = i, d
+        return best, min_dist
+
+    d = _dists_from(lat1_r, lon1_r, coslat1, VEH['lat'][idx], VEH['lon'][idx])
+    j = int(np.argmin(d))
+    return int(idx[j]), float(d[j])
+
+
+def nearest_available(code, lat, lon):
+    """
+    Row index and distance (km) of the closest available unit of type `code`,
+    or (None, None) if every one of them is busy.
+    """
+    # Usually one of the few nearest units is free, and every unit closer
+    # than the k-th is among them
+    p = unit_xyz(lat, lon).tolist()
+    idx = np.fromiter(_trees[code].nearest(p + p, NEAREST_K), dtype=np.intp)
+    idx = idx[VEH['status'][idx] == AVAILABLE]
+
+    if idx.size == 0:
+        # All of them are busy: scan every available unit of this type
+        idx = np.flatnonzero((VEH['type'] == code) & (VEH['status'] == AVAILABLE))
+        if idx.size == 0:
+            return None, None
+
+        if idx.size > NEAREST_K:
+            # Trig-free pre-rank by squared chord length on the precomputed
+            # unit-sphere points (same order as Haversine); only the best
+            # NEAREST_K go on to the exact distance pass
+            diff = VEH['xyz'][idx] - p
+            d2 = np.einsum('ij,ij->i', diff, diff)
+            idx = idx[np.argpartition(d2, NEAREST_K)[:NEAREST_K]]
+
+    return closest(idx, lat, lon)
+
+
+# ============ BACKGROUND WRITER ============
+
+# (sql, params) statements applied to SQLite off the request path
+_writes = queue.Queue()
+
+
+def _writer():
+    conn = connect_db()
+    while True:
+        sql, params = _writes.get()
+        try:
+            conn.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f"[WARN] Background write failed: {e}")
+        finally:
+            _writes.task_done()
+
+
+def flush_writes():
+    """Block until every queued write has reached SQLite."""
+    _writes.join()
+
+
+threading.Thread(target=_writer, daemon=True).start()
+
+
 # ============ FRONTEND ROUTES ============
 
 @app.route("/")
@@ -63,6 +317,7 @@ def request_unit():
     """
     Request closest available unit of a given type.
     """
+    global _vehicles_cache
     data = request.get_json(force=True) or {}
 
     req_type = str(data.get("type", "")).strip().lower()
@@ -76,47 +331,36 @@ def request_unit():
     except (TypeError, ValueError):
         return jsonify({"error": "Location must be numeric [lat, lon]"}), 400
 
-    # Query DB for available units of requested type
+    # Always take a pooled connection before _fleet_lock, never while holding it
     db = get_db()
-    cursor = db.execute(
-        "SELECT * FROM vehicles WHERE type = ? AND status = 'available'",
-        (req_type,)
-    )
-    candidates = cursor.fetchall()
-
-    if not candidates:
-        print(f"[INFO] No available unit for type={req_type}")
-        return jsonify({"error": "No available unit"}), 400
-
-    # Pick closest by distance
-    # Note: We do distance calc in Python because SQLite doesn't have SQRT/ACOS by default easily
-    # unless we load extensions, but for 50 vehicles Python is fine.
-    
-    best_unit = None
-    min_dist = float('inf')
+    with _fleet_lock:
+        if VEH is None:
+            load_fleet(db)
 
-    for v in candidates:
-        d = distance_km(lat, lon, v['lat'], v['lon'])
-        if d < min_dist:
-            min_dist = d
-            best_unit = v
+        code = VEH['type_codes'].get(req_type)
+        best, dist = nearest_available(code, lat, lon) if code is not None else (None, None)
 
-    if not best_unit:
-        return jsonify({"error": "Error finding closest unit"}), 500
+        if best is None:
+            print(f"[INFO] No available unit for type={req_type}")
+            return jsonify({"error": "No available unit"}), 400
 
-    # Mark it busy
-    db.execute("UPDATE vehicles SET status = 'busy' WHERE id = ?", (best_unit['id'],))
-    db.commit()
+        # Mark it busy
+        VEH['status'][best] = BUSY
+        _vehicles_cache = None
+        best_id = VEH['id'][best]
+        # Read while locked: a concurrent reset may swap VEH right after
+        best_lat, best_lon = float(VEH['lat'][best]), float(VEH['lon'][best])
+        _writes.put((SQL_MARK_BUSY, (best_id,)))
 
     print(
-        f"[INFO] Assigned {best_unit['id']} ({best_unit['type']}) "
-        f"from ({best_unit['lat']:.4f}, {best_unit['lon']:.4f}) "
-        f"to incident at ({lat:.4f}, {lon:.4f})"
+        f"[INFO] Assigned {best_id} ({req_type}) "
+        f"from ({best_lat:.4f}, {best_lon:.4f}) "
+        f"to incident at ({lat:.4f}, {lon:.4f}), {dist:.2f} km"
     )
 
     return jsonify({
-        "unit": best_unit['id'],
-        "from": {"lat": best_unit['lat'], "lon": best_unit['lon']},
+        "unit": best_id,
+        "from": {"lat": best_lat, "lon": best_lon},
         "to": {"lat": lat, "lon": lon}
     })
 
@@ -126,13 +370,16 @@ def get_vehicles():
     """
     Returns all vehicles (for dashboard + debugging).
     """
+    global _vehicles_cache
     db = get_db()
-    cursor = db.execute("SELECT * FROM vehicles")
-    rows = cursor.fetchall()
-    
-    # Convert to list of dicts
-    vehicles = [dict(row) for row in rows]
-    return jsonify(vehicles)
+    with _fleet_lock:
+        # Dashboard polls this; only re-serialize after a status change
+        if _vehicles_cache is None:
+            # SQLite must have every busy-mark before it serializes the table
+            flush_writes()
+            _vehicles_cache = db.execute(SQL_ALL_JSON).fetchone()[0]
+        payload = _vehicles_cache
+    return Response(payload, mimetype='application/json')
 
 
 @app.route("/api/reset", methods=["POST"])
@@ -141,8 +388,12 @@ def reset_vehicles():
     Reset all vehicles to 'available'.
     """
     db = get_db()
-    db.execute("UPDATE vehicles SET status = 'available'")
-    db.commit()
+    with _fleet_lock:
+        # Let pending busy-marks land first so they don't undo the reset
+        flush_writes()
+        db.execute(SQL_RESET)
+        # Reload positions too, in case units were repositioned by the optimizer
+        load_fleet(db)
     print("[INFO] Reset all vehicles to 'available'")
     return jsonify({"message": "All vehicles reset to available"})
 
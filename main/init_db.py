@@ -10,8 +10,14 @@ def init_db():
     if os.path.exists(DB_FILE):
         os.remove(DB_FILE)
         print(f"Removed existing {DB_FILE}")
+    # Stale WAL files from a previous database must not be replayed into the new one
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(DB_FILE + suffix):
+            os.remove(DB_FILE + suffix)
 
     conn = sqlite3.connect(DB_FILE)
+    # WAL lets the backend's writer thread and request readers run side by side
+    conn.execute("PRAGMA journal_mode=WAL")
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -1,203 +1,246 @@
-import csv
 import sys
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
 
 # =========================
 # CSV HELPERS
 # =========================
 
 def load_csv(path):
-    with open(path, newline="", encoding="utf-8") as f:
-        return list(csv.DictReader(f))
+    """
+    Load a CSV into a DataFrame in one columnar pass.
+    Every column is read as text (blanks as ""), like csv.DictReader;
+    numbers are parsed where they are used, so one bad cell can't abort the run.
+    """
+    return pd.read_csv(path, dtype=str, keep_default_na=False)
 
 
 def save_vehicles(path, vehicles, fieldnames=None):
-    if not vehicles:
+    """Write vehicles (a DataFrame or a list of dicts) to CSV in one pandas call."""
+    if len(vehicles) == 0:
         print("[WARN] No vehicles to save.")
         return
 
-    if not fieldnames:
-        fieldnames = list(vehicles[0].keys())
+    if isinstance(vehicles, pd.DataFrame):
+        df = vehicles if not fieldnames else vehicles.reindex(columns=fieldnames)
+    else:
+        df = pd.DataFrame(vehicles, columns=fieldnames or list(vehicles[0].keys()))
 
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(vehicles)
+    # Same line endings as csv.DictWriter; missing values are written blank
+    df.to_csv(path, index=False, encoding="utf-8", lineterminator="\r\n")
 
 
 # =========================
 # FACTOR SELECTION
 # =========================
 
-def choose_factor_scenario(factors, scenario_id=None):
+def safe_float(x, default=0.0):
+    try:
+        return float(x)
+    except Exception:
+        return default
+
+
+def index_factors(factors):
+    """
+    Index factor rows once for repeated scenario lookups.
+
+    Returns:
+      - factors_by_id: str(id) -> row (first row wins on duplicate ids)
+      - best_factor: row with the highest expected_call_volume
+    """
+    factors_by_id = {}
+    for row in factors:
+        factors_by_id.setdefault(str(row["id"]), row)
+
+    best_factor = max(factors, key=lambda r: safe_float(r.get("expected_call_volume", 0.0)))
+    return factors_by_id, best_factor
+
+
+def choose_factor_scenario(factors_by_id, best_factor, scenario_id=None):
     """
     Choose which scenario (row from factors.csv) to use.
 
     - If scenario_id is provided (e.g. command line argument),
       pick the row with matching id.
     - Otherwise, pick the row with the highest expected_call_volume.
+
+    factors_by_id / best_factor come from index_factors().
     """
     if scenario_id is not None:
-        for row in factors:
-            if str(row["id"]) == str(scenario_id):
-                return row
+        row = factors_by_id.get(str(scenario_id))
+        if row is not None:
+            return row
 
     # Fallback: pick scenario with highest expected_call_volume
-    def safe_float(x, default=0.0):
-        try:
-            return float(x)
-        except Exception:
-            return default
-
-    return max(factors, key=lambda r: safe_float(r.get("expected_call_volume", 0.0)))
+    return best_factor
 
 
 # =========================
 # ALLOCATION LOGIC
 # =========================
 
-def build_station_lookup(stations):
+def prepare_stations(stations):
     """
-    Returns:
-      - station_lookup: id -> station dict
-      - region_map: region -> list of station ids
+    Pull the stations DataFrame into parallel NumPy arrays:
+      - sid: station ids
+      - region: normalized region names
+      - lat / lon: station location (NaN if missing or not a number)
+      - cap_ambulance / cap_police / cap_fire: int capacities (anything that
+        isn't an integer -> 0)
     """
-    station_lookup = {}
-    region_map = {}
+    n = len(stations)
 
-    for s in stations:
-        sid = s["id"]
-        station_lookup[sid] = s
+    def column(name, default):
+        return stations[name] if name in stations else pd.Series([default] * n, index=stations.index)
 
-        region = s.get("region", "").strip().lower()
-        region_map.setdefault(region, []).append(sid)
+    # Regions are interned so by_region lookups against the (also interned)
+    # hot region hit the identity fast path
+    regions = column("region", "").str.strip().str.lower()
 
-    return station_lookup, region_map
+    soa = {
+        "sid": stations["id"].to_numpy(dtype=object),
+        "region": np.array([sys.intern(r) for r in regions], dtype=object),
+        "lat": pd.to_numeric(column("lat", "").str.strip(), errors="coerce").to_numpy(dtype=np.float64),
+        "lon": pd.to_numeric(column("lon", "").str.strip(), errors="coerce").to_numpy(dtype=np.float64),
+    }
+    for vtype in ("ambulance", "police", "fire"):
+        # Same rule as int(): "2.5" or "x" is not a capacity
+        cap = column(f"capacity_{vtype}", "0").str.strip()
+        cap = cap.where(cap.str.fullmatch(r"[+-]?\d+"), "0")
+        soa[f"cap_{vtype}"] = pd.to_numeric(cap).to_numpy(dtype=np.int64)
+    return soa
 
 
-def compute_station_weights(stations, factor, vehicle_type):
+def build_station_lookup(soa):
     """
-    Compute a weight for each station for this vehicle_type based on:
-      - station capacity for that type
-      - whether the station's region matches the "hot" factor region
-      - expected_call_volume (boost hotspot)
+    soa is the output of prepare_stations().
 
-    Returns: dict station_id -> weight (int >= 0)
+    Returns by_region: region -> array of station indices
     """
-    region_hot = factor.get("region", "").strip().lower()
-    try:
-        expected_volume = float(factor.get("expected_call_volume", 0.0))
-    except Exception:
-        expected_volume = 0.0
+    region_rows = {}
+    for i, region in enumerate(soa["region"].tolist()):
+        region_rows.setdefault(region, []).append(i)
+
+    return {r: np.array(rows, dtype=np.intp) for r, rows in region_rows.items()}
+
+
+def hot_region_boost(factor):
+    """
+    Returns (hot region, weight multiplier for stations in it) for a factor row.
+    """
+    region_hot = sys.intern(factor.get("region", "").strip().lower())
+    expected_volume = safe_float(factor.get("expected_call_volume", 0.0))
 
     # extra boost for hot region
     hot_multiplier = 1.0 + expected_volume  # e.g., volume=0.9 -> 1.9x
-    base_multiplier = 1.0
+    return region_hot, hot_multiplier
 
-    if vehicle_type == "ambulance":
-        cap_field = "capacity_ambulance"
-    elif vehicle_type == "police":
-        cap_field = "capacity_police"
-    else:
-        cap_field = "capacity_fire"
 
-    weights = {}
-    for s in stations:
-        sid = s["id"]
-        region = s.get("region", "").strip().lower()
+def compute_station_weights(soa, by_region, region_hot, hot_multiplier, vehicle_type):
+    """
+    Compute a weight for each station for this vehicle_type based on:
+      - station capacity for that type
+      - whether the station's region matches the "hot" factor region
+      - expected_call_volume (boost hotspot, via hot_multiplier)
 
-        try:
-            cap = int(s.get(cap_field, "0"))
-        except Exception:
-            cap = 0
+    soa / by_region come from prepare_stations() / build_station_lookup().
 
-        if cap <= 0:
-            continue  # this station doesn't house this type
+    Returns: (station indices, weights) as parallel arrays, only stations
+    with weight > 0, in station order
+    """
+    if vehicle_type in ("ambulance", "police"):
+        cap = soa[f"cap_{vehicle_type}"]
+    else:
+        cap = soa["cap_fire"]
 
-        # base weight is capacity
-        w = cap
+    # base weight is capacity; stations in the hot region get boosted
+    w = cap.copy()
+    hot = by_region.get(region_hot)
+    if hot is not None:
+        w[hot] = np.round(cap[hot] * hot_multiplier).astype(np.int64)
 
-        # if this station is in the hot region, boost its weight
-        if region == region_hot:
-            w = int(round(w * hot_multiplier))
-        else:
-            w = int(round(w * base_multiplier))
+    # skip stations that don't house this type, and non-positive weights
+    keep = np.flatnonzero((cap > 0) & (w > 0))
+    return keep, w[keep]
 
-        if w < 0:
-            w = 0
 
-        if w > 0:
-            weights[sid] = w
+def pick_stations(n_vehicles, stn, w):
+    """
+    Weighted round-robin over stations without expanding each station w times:
+    position p in the cycle belongs to the first station whose cumulative
+    weight exceeds p.
 
-    return weights
+    Returns the station index for each of n_vehicles, in order.
+    """
+    cum = np.cumsum(w)
+    positions = np.arange(n_vehicles) % cum[-1]
+    return stn[np.searchsorted(cum, positions, side="right")]
 
 
 def assign_vehicles_to_stations(vehicles, stations, factor):
     """
-    Pure heuristic allocator:
+    Pure heuristic allocator over the vehicles DataFrame:
       - Groups vehicles by type (ambulance/police/fire)
       - Computes station weights for each type
       - Uses weighted round-robin assignment to choose a station
       - Sets vehicle lat/lon to that station location
       - Adds/updates 'station_id' for each vehicle
+
+    Updates `vehicles` in place and returns it.
     """
     # Pre-build lookups
-    station_lookup, _ = build_station_lookup(stations)
+    station_soa = prepare_stations(stations)
+    by_region = build_station_lookup(station_soa)
+    region_hot, hot_multiplier = hot_region_boost(factor)
 
-    # Prepare vehicles by type
-    vehicles_by_type = {
-        "ambulance": [],
-        "police": [],
-        "fire": []
-    }
-    for v in vehicles:
-        vtype = v["type"].strip().lower()
-        if vtype in vehicles_by_type:
-            vehicles_by_type[vtype].append(v)
-        else:
-            # Unknown type -> leave it untouched
-            pass
-
-    # For each vehicle type, assign stations
-    for vtype, vlist in vehicles_by_type.items():
-        if not vlist:
-            continue
+    if "station_id" not in vehicles:
+        vehicles["station_id"] = ""
+
+    lat_col = vehicles.columns.get_loc("lat")
+    lon_col = vehicles.columns.get_loc("lon")
+    sid_col = vehicles.columns.get_loc("station_id")
+
+    # Unknown types are left untouched
+    vtypes = vehicles["type"].str.strip().str.lower().to_numpy()
+
+    def plan(vtype):
+        """(vehicle rows, picked station indices) for one type, or None to skip it."""
+        rows = np.flatnonzero(vtypes == vtype)
+        if rows.size == 0:
+            return None
 
         # Compute station weights for this type
-        weights = compute_station_weights(stations, factor, vtype)
+        stn, w = compute_station_weights(station_soa, by_region, region_hot, hot_multiplier, vtype)
 
-        if not weights:
+        if stn.size == 0:
             print(f"[WARN] No stations with capacity for type={vtype}. "
                   f"Vehicles of this type keep their existing positions.")
-            continue
-
-        # Build a flat weighted list of station_ids
-        weighted_station_ids = []
-        for sid, w in weights.items():
-            weighted_station_ids.extend([sid] * w)
+            return None
 
-        if not weighted_station_ids:
-            print(f"[WARN] All station weights for type={vtype} are zero; "
-                  f"vehicles keep existing positions.")
-            continue
+        return rows, pick_stations(rows.size, stn, w)
 
-        # Assign each vehicle in round-robin over the weighted list
-        n = len(weighted_station_ids)
-        for i, v in enumerate(vlist):
-            sid = weighted_station_ids[i % n]
-            st = station_lookup.get(sid)
-            if not st:
-                # Shouldn't happen, but safety check
-                continue
+    # Types are independent and the work is NumPy, so plan them in parallel;
+    # DataFrame writes stay on this thread
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        plans = list(pool.map(plan, ("ambulance", "police", "fire")))
 
-            # Update vehicle location to station location
-            try:
-                v["lat"] = float(st["lat"])
-                v["lon"] = float(st["lon"])
-            except Exception:
-                pass
+    for p in plans:
+        if p is None:
+            continue
+        rows, picks = p
 
-            v["station_id"] = sid
+        # Move vehicles to their picked station; a station without a
+        # usable location still gets the vehicle's station_id
+        vehicles.iloc[rows, sid_col] = station_soa["sid"][picks]
+        located = ~(np.isnan(station_soa["lat"][picks]) | np.isnan(station_soa["lon"][picks]))
+        # Coordinates stay text, so vehicles that aren't moved keep their original spelling
+        moved = picks[located]
+        vehicles.iloc[rows[located], lat_col] = [str(x) for x in station_soa["lat"][moved].tolist()]
+        vehicles.iloc[rows[located], lon_col] = [str(x) for x in station_soa["lon"][moved].tolist()]
 
     return vehicles
 
@@ -228,27 +271,27 @@ def main():
 
     vehicles = load_csv(vehicles_path)
     stations = load_csv(stations_path)
-    factors = load_csv(factors_path)
+    factors = load_csv(factors_path).to_dict("records")
 
     # Optional scenario id from command line: python optimize_allocation.py 2
     scenario_id = sys.argv[1] if len(sys.argv) > 1 else None
-    factor = choose_factor_scenario(factors, scenario_id=scenario_id)
+    factors_by_id, best_factor = index_factors(factors)
+    factor = choose_factor_scenario(factors_by_id, best_factor, scenario_id=scenario_id)
 
     print("[INFO] Using factor scenario:", factor)
 
     # Normalize vehicle types & status
-    for v in vehicles:
-        v["type"] = v["type"].strip().lower()
-        v["status"] = v.get("status", "available").strip().lower()
-        if v["status"] not in ("available", "busy"):
-            v["status"] = "available"
+    vehicles["type"] = vehicles["type"].str.strip().str.lower()
+    if "status" in vehicles:
+        vehicles["status"] = vehicles["status"].str.strip().str.lower()
+    else:
+        vehicles["status"] = "available"
+    vehicles.loc[~vehicles["status"].isin(["available", "busy"]), "status"] = "available"
 
     updated_vehicles = assign_vehicles_to_stations(vehicles, stations, factor)
 
-    # Decide fieldnames: keep original fields plus station_id if missing
-    fieldnames = list(updated_vehicles[0].keys())
-    if "station_id" not in fieldnames:
-        fieldnames.append("station_id")
+    # Original fields plus station_id (added by the allocator if missing)
+    fieldnames = list(updated_vehicles.columns)
 
     save_vehicles(output_path, updated_vehicles, fieldnames=fieldnames)
 
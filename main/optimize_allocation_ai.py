@@ -137,23 +137,40 @@ def optimize_allocation(vehicles, stations, factor_scenario):
 # ========== UPDATE DB ==========
 
 def update_db(assignments):
-    """Update vehicle positions in SQLite."""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    count = 0
+    """Update vehicle positions in SQLite in a single transaction."""
+    # Coerce up front so one bad row is dropped here instead of failing the batch
+    rows = []
     for a in assignments:
         try:
-            cursor.execute(
-                "UPDATE vehicles SET lat = ?, lon = ?, station_id = ? WHERE id = ?",
-                (a["lat"], a["lon"], a.get("station_id", ""), a["id"])
-            )
-            count += 1
-        except Exception as e:
-            print(f"[WARN] Failed to update {a.get('id')}: {e}")
+            station_id = a.get("station_id", "")
+            rows.append((
+                float(a["lat"]),
+                float(a["lon"]),
+                None if station_id is None else str(station_id),
+                str(a["id"]),
+            ))
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            print(f"[WARN] Skipping malformed assignment {a!r}: {e}")
+
+    conn = sqlite3.connect(DB_FILE, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+
+    try:
+        conn.execute("BEGIN")
+        cursor = conn.executemany(
+            "UPDATE vehicles SET lat = ?, lon = ?, station_id = ? WHERE id = ?",
+            rows
+        )
+        conn.execute("COMMIT")
+        count = cursor.rowcount
+    except sqlite3.Error as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        print(f"[WARN] Failed to update vehicle positions: {e}")
+        count = 0
+    finally:
+        conn.close()
 
-    conn.commit()
-    conn.close()
     print(f"[INFO] Updated {count} vehicle positions in DB")
 
 